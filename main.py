@@ -1,70 +1,89 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-import pdfplumber
-import io
-import json
-import base64
-from pydantic import BaseModel
-from langdetect import detect, DetectorFactory
-
-DetectorFactory.seed = 0
-
-app = FastAPI(title="PDF Text Extractor API")
-
-def extract_text_from_pdf_stream(pdf_stream):
-    pages_data = []
-    with pdfplumber.open(pdf_stream) as pdf:
-        for i, page in enumerate(pdf.pages):
-            page_num = i + 1
-            text = page.extract_text()
-            if text:
-                try:
-                    lang = detect(text)
-                except:
-                    lang = "unknown"
-                    
-                pages_data.append({
-                    "language": lang,
-                    "pagenumber": page_num,
-                    "raw_text": text,
-                })
-    return pages_data
-
-@app.post("/extract_file")
-async def extract_pdf_endpoint(file: UploadFile = File(...)):
-   
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Only PDF files are supported.")
-
-    try:
-        contents = await file.read()
-        pdf_stream = io.BytesIO(contents)
-        
-        pages_data = extract_text_from_pdf_stream(pdf_stream)
-        
-        return {"data": pages_data}
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
-
-class PDFRequest(BaseModel):
-    contentType: str
-    contentBytes: str
-
-@app.post("/extract_text")
-async def extract_from_bytes_endpoint(request: PDFRequest):
-    if request.contentType.upper() != "PDF":
-        raise HTTPException(status_code=400, detail="Only PDF content type is supported.")
-
-    try:
-        pdf_bytes = base64.b64decode(request.contentBytes)
-        pdf_stream = io.BytesIO(pdf_bytes)
-        
-        pages_data = extract_text_from_pdf_stream(pdf_stream)
-        
-        return {"data": pages_data}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing base64 PDF: {str(e)}")
-
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import orjson
+from typing import Dict, Optional
+from pydantic import BaseModel
+
+from pdf_kernel import iter_pages, extract_text_from_pdf_stream, parse_pdf_content
+
+# pybase64 decodes with libbase64's SIMD kernels; payloads are tens of MB.
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+app = FastAPI(title="PDF Text Extractor API", default_response_class=ORJSONResponse)
+
+@app.post("/extract_file")
+async def extract_pdf_endpoint(file: UploadFile = File(...), preserve_layout: bool = False):
+
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported.")
+
+    try:
+        # UploadFile spools large uploads to disk; hand that stream straight
+        # to the kernel instead of buffering the whole file with read().
+        pages_data = extract_text_from_pdf_stream(file.file, preserve_layout=preserve_layout)
+
+        return {"data": pages_data}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+
+class PDFRequest(BaseModel):
+    contentType: str
+    contentBytes: str
+    preserveLayout: bool = False
+
+@app.post("/extract_text")
+async def extract_from_bytes_endpoint(request: PDFRequest):
+    if request.contentType.upper() != "PDF":
+        raise HTTPException(status_code=400, detail="Only PDF content type is supported.")
+
+    try:
+        pdf_bytes = base64.b64decode(request.contentBytes, validate=False)
+
+        pages_data = extract_text_from_pdf_stream(pdf_bytes, preserve_layout=request.preserveLayout)
+
+        return {"data": pages_data}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing base64 PDF: {str(e)}")
+
+@app.post("/extract_stream")
+async def extract_stream_endpoint(request: PDFRequest):
+    if request.contentType.upper() != "PDF":
+        raise HTTPException(status_code=400, detail="Only PDF content type is supported.")
+
+    try:
+        pdf_bytes = base64.b64decode(request.contentBytes, validate=False)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid base64 payload: {str(e)}")
+
+    def ndjson_pages():
+        # One JSON line per page, serialized as bytes with orjson; pages ship
+        # as they are produced instead of buffering the whole document.
+        for page in iter_pages(pdf_bytes, preserve_layout=request.preserveLayout):
+            yield orjson.dumps(page) + b"\n"
+
+    return StreamingResponse(ndjson_pages(), media_type="application/x-ndjson")
+
+class PDFParseRequest(BaseModel):
+    contentType: str
+    contentBytes: str
+    rules: Optional[Dict[str, str]] = None
+
+@app.post("/extract_json")
+async def parse_pdf_endpoint(request: PDFParseRequest):
+    if request.contentType.upper() != "PDF":
+        raise HTTPException(status_code=400, detail="Only PDF content type is supported.")
+
+    try:
+        pdf_bytes = base64.b64decode(request.contentBytes, validate=False)
+        parsed = parse_pdf_content(pdf_bytes, request.rules)
+        return {"data": parsed}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error parsing PDF: {str(e)}")
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
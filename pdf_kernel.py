@@ -0,0 +1,383 @@
+"""Shared PDF extraction kernel.
+
+Holds the extraction, OCR and parsing machinery plus its module-level
+state (compiled regexes, the Tesseract API singleton, the content-hash
+result cache) so every consumer shares one copy per process.
+"""
+
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+import pdfplumber
+from langdetect import detect, DetectorFactory
+
+try:
+    from pdf2image import convert_from_bytes
+    from PIL import Image
+    _PDF2IMAGE_AVAILABLE = True
+except ImportError:
+    _PDF2IMAGE_AVAILABLE = False
+
+# tesserocr keeps one in-process Tesseract API alive instead of forking a
+# tesseract binary (and reloading traineddata) per page; preferred when built.
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+OCR_AVAILABLE = _PDF2IMAGE_AVAILABLE and (tesserocr is not None or pytesseract is not None)
+
+try:
+    import re2 as _re2
+except ImportError:
+    _re2 = None
+
+try:
+    import cachetools
+except ImportError:
+    cachetools = None
+
+# PyMuPDF's C parser extracts text an order of magnitude faster than the
+# pdfplumber/pdfminer stack; pdfplumber stays for layout mode and tables.
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+DetectorFactory.seed = 0
+
+OCR_CONCURRENCY = int(os.environ.get("OCR_CONCURRENCY", os.cpu_count() or 1))
+# 200 DPI grayscale is ~7x fewer pixels than 300 DPI RGB with negligible
+# accuracy loss at common font sizes; low-confidence pages retry at 300.
+OCR_DPI = int(os.environ.get("OCR_DPI", "200"))
+OCR_RETRY_DPI = 300
+OCR_MIN_CONF = int(os.environ.get("OCR_MIN_CONF", "40"))
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", "4"))
+PDF_CACHE_MB = int(os.environ.get("PDF_CACHE_MB", "64"))
+
+def _pages_sizeof(pages_data):
+    return sum(len(page["raw_text"]) + 64 for page in pages_data) or 1
+
+# Retriers and batch jobs resubmit identical attachments; re-parsing them is
+# far more expensive than a blake2b digest over the raw bytes. Sized in bytes
+# of cached text; PDF_CACHE_MB=0 disables.
+_PDF_CACHE = (
+    cachetools.LRUCache(maxsize=PDF_CACHE_MB * 1024 * 1024, getsizeof=_pages_sizeof)
+    if cachetools is not None and PDF_CACHE_MB > 0
+    else None
+)
+_PDF_CACHE_LOCK = threading.Lock()
+
+def _compile_linear(pattern):
+    """Compile a pattern with RE2 when google-re2 is installed.
+
+    RE2 executes in linear time (no backtracking) and in native code, which
+    matters when scanning multi-megabyte raw_text; falls back to re.
+    """
+    if _re2 is not None:
+        try:
+            return _re2.compile(pattern)
+        except Exception:
+            pass
+    return re.compile(pattern)
+
+# Matches "Key: value" lines for rule-less field auto-discovery.
+GENERIC_PATTERN = _compile_linear(r"(?m)^([^:\n]+):\s*(.+)$")
+
+# C-level per-char remap for table cells; cheaper than chained .replace.
+_CELL_TRANS = str.maketrans({"\n": " ", "\r": " ", "\t": " "})
+
+_MULTISPACE_RE = _compile_linear(r"[ \t]{3,}")
+_TRAILWS_RE = _compile_linear(r"(?m)[ \t]+$")
+_BLANKRUN_RE = _compile_linear(r"\n{3,}")
+
+def clean_text(text):
+    """Collapse wide space runs, trailing whitespace and blank-line runs.
+
+    Whole-string substitutions keep the work in the regex engine instead
+    of a Python-level per-line loop.
+    """
+    text = _MULTISPACE_RE.sub(" ", text)
+    text = _TRAILWS_RE.sub("", text)
+    text = _BLANKRUN_RE.sub("\n\n", text)
+    return text.strip()
+
+# The compiled extension (text_clean.pyx, built via setup.py) does the same
+# normalization in one C-speed scan; prefer it when it has been built.
+try:
+    from text_clean import clean_text
+except ImportError:
+    pass
+
+@lru_cache(maxsize=2048)
+def _compile(pattern, flags):
+    return re.compile(pattern, flags)
+
+_TESS_API = None
+_TESS_LOCK = threading.Lock()
+
+def _ocr_image(image):
+    """OCR a PIL image; returns (text, mean confidence 0-100 or None)."""
+    if tesserocr is not None:
+        global _TESS_API
+        # PyTessBaseAPI is not thread-safe, so the singleton is lock-guarded;
+        # ProcessPoolExecutor workers each hold their own copy of this module
+        # state, so pooled OCR still runs one API per process.
+        with _TESS_LOCK:
+            if _TESS_API is None:
+                _TESS_API = tesserocr.PyTessBaseAPI(lang="eng")
+            _TESS_API.SetImage(image)
+            text = _TESS_API.GetUTF8Text()
+            return text, _TESS_API.MeanTextConf()
+    # Confidence via pytesseract needs a second tesseract run
+    # (image_to_data), so the subprocess path skips the retry heuristic.
+    return pytesseract.image_to_string(image), None
+
+def _ocr_image_file(image_path):
+    return _ocr_image(Image.open(image_path))
+
+def _ocr_page_hires(args):
+    pdf_bytes, page_num = args
+    images = convert_from_bytes(
+        pdf_bytes,
+        first_page=page_num,
+        last_page=page_num,
+        dpi=OCR_RETRY_DPI,
+        grayscale=True,
+        fmt="png",
+    )
+    if not images:
+        return ""
+    return _ocr_image(images[0])[0]
+
+def _page_text(page, preserve_layout):
+    # A page with no char objects has no text layer at all (scanned page);
+    # answer straight away instead of paying for an extract_text pass that
+    # can only come back empty.
+    if not page.chars:
+        return ""
+    if preserve_layout:
+        # Layout reconstruction clusters every char spatially and is several
+        # times slower than the plain pass, so it is strictly opt-in.
+        text = page.extract_text(
+            x_tolerance=3, y_tolerance=3, layout=True, x_density=7.25, y_density=13
+        )
+        if text:
+            return text
+    return page.extract_text() or ""
+
+def _extract_chunk_texts(args):
+    pdf_bytes, indices, preserve_layout = args
+    chunk_texts = []
+    # Each worker gets its own pdfplumber handle: Page objects share the
+    # parent PDF's stream, so one handle cannot be read from two threads.
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        pages = pdf.pages
+        for i in indices:
+            page = pages[i]
+            chunk_texts.append(clean_text(_page_text(page, preserve_layout)))
+            # pdfplumber accumulates per-page layout objects (chars, lines,
+            # rects) as pages are visited; drop them so peak memory stays at
+            # one page instead of the whole document.
+            page.flush_cache()
+            if hasattr(page, "get_textmap"):
+                page.get_textmap.cache_clear()
+    return chunk_texts
+
+def _extract_all_texts(pdf_bytes, preserve_layout):
+    if fitz is not None and not preserve_layout:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            texts = [
+                clean_text(doc.load_page(i).get_text("text"))
+                for i in range(doc.page_count)
+            ]
+        finally:
+            doc.close()
+        # MuPDF occasionally yields nothing where pdfminer finds a text
+        # layer; retry just those pages with pdfplumber before they are
+        # treated as scanned and handed to OCR.
+        blanks = [i for i, text in enumerate(texts) if not text]
+        if blanks:
+            retried = _extract_chunk_texts((pdf_bytes, blanks, preserve_layout))
+            for i, text in zip(blanks, retried):
+                texts[i] = text
+        return texts
+
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        page_count = len(pdf.pages)
+    workers = max(1, min(PDF_WORKERS, page_count))
+    if workers == 1 or page_count < 2 * workers:
+        return _extract_chunk_texts((pdf_bytes, range(page_count), preserve_layout))
+
+    step = -(-page_count // workers)
+    chunks = [range(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+        results = executor.map(
+            _extract_chunk_texts,
+            [(pdf_bytes, chunk, preserve_layout) for chunk in chunks],
+        )
+    return [text for chunk_texts in results for text in chunk_texts]
+
+def iter_pages(pdf_source, preserve_layout=False, ocr=True, detect_lang=True):
+    # Accepts raw bytes or any seekable binary stream (e.g. the spooled
+    # temporary file behind an UploadFile), read exactly once here.
+    if isinstance(pdf_source, (bytes, bytearray)):
+        pdf_bytes = bytes(pdf_source)
+    else:
+        pdf_source.seek(0)
+        pdf_bytes = pdf_source.read()
+
+    if _PDF_CACHE is None:
+        yield from _iter_pages_uncached(pdf_bytes, preserve_layout, ocr, detect_lang)
+        return
+
+    key = (
+        hashlib.blake2b(pdf_bytes, digest_size=16).digest(),
+        preserve_layout,
+        ocr,
+        detect_lang,
+    )
+    with _PDF_CACHE_LOCK:
+        cached = _PDF_CACHE.get(key)
+    if cached is None:
+        cached = list(_iter_pages_uncached(pdf_bytes, preserve_layout, ocr, detect_lang))
+        with _PDF_CACHE_LOCK:
+            try:
+                _PDF_CACHE[key] = cached
+            except ValueError:
+                # Single result larger than the whole cache; serve uncached.
+                pass
+    yield from cached
+
+def _iter_pages_uncached(pdf_bytes, preserve_layout=False, ocr=True, detect_lang=True):
+    texts = _extract_all_texts(pdf_bytes, preserve_layout)
+
+    blank_pages = [i for i, text in enumerate(texts) if not text]
+    if blank_pages and ocr and OCR_AVAILABLE:
+        tmpdir = tempfile.mkdtemp(prefix="pdfocr-")
+        try:
+            # Rasterize the document once; Poppler re-parses the whole PDF
+            # on every single-page call, and paths_only avoids holding one
+            # PIL image per page in memory.
+            rendered_paths = convert_from_bytes(
+                pdf_bytes,
+                dpi=OCR_DPI,
+                grayscale=True,
+                output_folder=tmpdir,
+                paths_only=True,
+                fmt="png",
+                thread_count=OCR_CONCURRENCY,
+            )
+            jobs = [rendered_paths[i] for i in blank_pages]
+            workers = min(OCR_CONCURRENCY, len(blank_pages))
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    ocr_results = list(executor.map(_ocr_image_file, jobs))
+            else:
+                ocr_results = [_ocr_image_file(job) for job in jobs]
+            for i, (ocr_text, _) in zip(blank_pages, ocr_results):
+                texts[i] = clean_text(ocr_text)
+
+            # Pages whose mean confidence came back low get one re-render at
+            # full resolution; typically a handful, so this stays cheap.
+            retry_pages = [
+                i
+                for i, (_, conf) in zip(blank_pages, ocr_results)
+                if conf is not None and conf < OCR_MIN_CONF
+            ]
+            if retry_pages and OCR_MIN_CONF > 0:
+                retry_jobs = [(pdf_bytes, i + 1) for i in retry_pages]
+                retry_workers = min(OCR_CONCURRENCY, len(retry_pages))
+                if retry_workers > 1:
+                    with ProcessPoolExecutor(max_workers=retry_workers) as executor:
+                        retry_texts = list(executor.map(_ocr_page_hires, retry_jobs))
+                else:
+                    retry_texts = [_ocr_page_hires(job) for job in retry_jobs]
+                for i, retry_text in zip(retry_pages, retry_texts):
+                    texts[i] = clean_text(retry_text)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    # langdetect is O(len(text)) and n-gram identification saturates well
+    # before 1KB, so detect once on a short sample of the first non-empty
+    # page and reuse the result for the rest of the document.
+    doc_lang = None
+    for i, text in enumerate(texts):
+        if text:
+            if detect_lang and doc_lang is None:
+                try:
+                    doc_lang = detect(text[:2048])
+                except:
+                    doc_lang = "unknown"
+
+            yield {
+                "language": doc_lang,
+                "pagenumber": i + 1,
+                "raw_text": text,
+            }
+
+def extract_pages(pdf_bytes, *, ocr=True, layout=False, detect_lang=False):
+    """Extract per-page text from raw PDF bytes as a list of page dicts."""
+    return list(
+        _iter_pages_uncached(pdf_bytes, preserve_layout=layout, ocr=ocr, detect_lang=detect_lang)
+    )
+
+def extract_text_from_pdf_stream(pdf_source, preserve_layout=False):
+    return list(iter_pages(pdf_source, preserve_layout=preserve_layout))
+
+def parse_pdf_content(pdf_bytes, rules=None):
+    page_texts = []
+    tables = []
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        # pdf.pages is a property; grab the list once instead of re-walking
+        # the page tree on every access.
+        pages = pdf.pages
+        if not pages:
+            return {"error": "PDF has no pages."}
+        for page in pages:
+            page_texts.append(page.extract_text() or "")
+            for table in page.extract_tables():
+                cleaned_table = []
+                for row in table:
+                    if all(cell is None for cell in row):
+                        continue
+                    cleaned_table.append([
+                        cell.translate(_CELL_TRANS).strip() if cell else ""
+                        for cell in row
+                    ])
+                if cleaned_table:
+                    tables.append(cleaned_table)
+            page.flush_cache()
+            if hasattr(page, "get_textmap"):
+                page.get_textmap.cache_clear()
+    raw_text = clean_text("\n".join(page_texts))
+
+    fields = {}
+    if rules:
+        # Rulesets are typically fixed across requests, so compiled
+        # patterns are memoized instead of recompiled per call.
+        for field, pattern in rules.items():
+            match = _compile(pattern, re.IGNORECASE | re.MULTILINE).search(raw_text)
+            if match:
+                fields[field] = (match.group(1) if match.groups() else match.group(0)).strip()
+            else:
+                fields[field] = None
+    else:
+        for match in GENERIC_PATTERN.finditer(raw_text):
+            key = match.group(1).strip()
+            if key and key not in fields:
+                fields[key] = match.group(2).strip()
+    return {"fields": fields, "tables": tables}
@@ -0,0 +1,16 @@
+"""Build script for the optional compiled text_clean extension.
+
+The service runs fine without it; pdf_kernel falls back to its regex
+clean_text when the extension has not been built. Requires Cython:
+
+    pip install cython
+    python setup.py build_ext --inplace
+"""
+
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name="text-extraction",
+    ext_modules=cythonize("text_clean.pyx"),
+)
@@ -0,0 +1,46 @@
+# cython: language_level=3
+"""Compiled single-pass clean_text.
+
+Optional drop-in for pdf_kernel.clean_text: one scan over the string at
+C speed instead of three regex passes. Build in place with
+
+    python setup.py build_ext --inplace
+
+pdf_kernel picks it up automatically when the extension is importable
+and keeps the regex implementation as the fallback.
+"""
+
+cpdef str clean_text(str text):
+    """Collapse wide space runs, trailing whitespace and blank-line runs.
+
+    Matches the regex implementation in pdf_kernel exactly: runs of three
+    or more spaces/tabs become one space, trailing spaces/tabs on each
+    line are dropped, runs of blank lines collapse to one, and the result
+    is stripped.
+    """
+    cdef Py_ssize_t i, n = len(text)
+    cdef Py_UCS4 c
+    cdef int nl_run = 0
+    cdef list out = []
+    cdef list pending = []
+    for i in range(n):
+        c = text[i]
+        if c == u' ' or c == u'\t':
+            # Buffer the whitespace run; it is dropped if the line ends
+            # here and collapsed to one space if it reaches length three.
+            pending.append(c)
+        elif c == u'\n':
+            del pending[:]
+            nl_run += 1
+        else:
+            if nl_run:
+                out.append(u'\n' if nl_run == 1 else u'\n\n')
+                nl_run = 0
+            if pending:
+                if len(pending) >= 3:
+                    out.append(u' ')
+                else:
+                    out.extend(pending)
+                del pending[:]
+            out.append(c)
+    return u''.join(out).strip()